@@ -7,6 +7,8 @@ Using PyCryptodome for Windows compatibility
 import hashlib
 import json
 import os
+import numpy as np
+from functools import lru_cache
 from Crypto.PublicKey import ECC
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
@@ -14,6 +16,46 @@ from Crypto.Protocol.KDF import HKDF
 from Crypto.Hash import SHA256
 from models import SystemParams, UserKeys, AccessPolicy, Ciphertext, ReencryptionKey, ReencryptedCiphertext, compute_hash, compute_binding
 
+# Policies with more rows compute shares as one NumPy matrix-vector product
+VECTOR_MIN_ROWS = 8
+
+
+@lru_cache(maxsize=4096)
+def _solve_lsss(matrix: tuple, rows: frozenset, p: int):
+    """
+    LSSS reconstruction: find ω with Σ_{i∈rows} ω_i M_i = (1, 0, ..., 0) mod p
+    Depends only on the policy matrix and the satisfying rows, so it is cached
+    Returns {i: ω_i}, or None if the rows do not span the target vector
+    """
+    idx = sorted(rows)
+    n, n_cols = len(idx), len(matrix[0]) if matrix else 0
+    # Augmented system M_I^T ω = e_1, one equation per column of M
+    aug = [[matrix[i][c] % p for i in idx] + [int(c == 0)] for c in range(n_cols)]
+    
+    pivots = []
+    for col in range(n):
+        r = len(pivots)
+        pivot = next((k for k in range(r, n_cols) if aug[k][col]), None)
+        if pivot is None:
+            continue
+        aug[r], aug[pivot] = aug[pivot], aug[r]
+        inv = pow(aug[r][col], -1, p)
+        aug[r] = [x * inv % p for x in aug[r]]
+        for k in range(n_cols):
+            f = aug[k][col]
+            if k != r and f:
+                aug[k] = [(x - f * y) % p for x, y in zip(aug[k], aug[r])]
+        pivots.append(col)
+    
+    # Remaining equations have no unknowns left; any non-zero RHS is unsatisfiable
+    if any(row[n] for row in aug[len(pivots):]):
+        return None
+    
+    omega = dict.fromkeys(idx, 0)
+    for k, col in enumerate(pivots):
+        omega[idx[col]] = aug[k][n]
+    return omega
+
 
 class CPABEProxyReenc:
     """
@@ -25,6 +67,49 @@ class CPABEProxyReenc:
         """Initialize with pairing group"""
         self.group = PairingGroup(curve)
         self.util = SecretUtil(self.group, verbose=False)
+        self._order = int(self.group.order())
+        # Attribute strings hashed to G1 (small, repeated vocabulary)
+        self._attr_hash_cache = {}
+        # Attributes whose cached hash has a fixed-base exponentiation table
+        self._attr_pp = set()
+    
+    def _H1(self, attr: str):
+        """Hash an attribute string to G1, memoized per engine"""
+        attr_hash = self._attr_hash_cache.get(attr)
+        if attr_hash is None:
+            attr_hash = self.group.hash(attr, G1)
+            self._attr_hash_cache[attr] = attr_hash
+        return attr_hash
+    
+    def _omega(self, policy: AccessPolicy, user_attrs) -> dict:
+        """Cached LSSS coefficients for the policy rows the user's attributes satisfy"""
+        user_attrs = set(user_attrs)
+        rows = frozenset(i for i, attr in policy.rho.items() if attr in user_attrs)
+        return _solve_lsss(tuple(map(tuple, policy.matrix)), rows, self._order)
+    
+    def _random_zr(self, count: int) -> list:
+        """Draw count random ZR elements from one get_random_bytes call"""
+        pool = get_random_bytes(32 * count)
+        return [self.group.init(ZR, int.from_bytes(pool[i:i + 32], 'big') % self._order)
+                for i in range(0, len(pool), 32)]
+    
+    def _compute_shares(self, M: np.ndarray, v: list) -> list:
+        """
+        LSSS shares λ_i = M_i · v over ZR
+        Wide policies use one NumPy product over integers mod p; small ones
+        lift matrix entries to ZR once and skip zero entries
+        """
+        if len(M) > VECTOR_MIN_ROWS:
+            # p is ~160 bits, beyond int64: object arrays keep exact integers
+            # while NumPy drives the loops
+            v_int = np.array([int(x) for x in v], dtype=object)
+            lambdas = M.astype(object) @ v_int
+            return [self.group.init(ZR, int(x) % self._order) for x in lambdas]
+        
+        zero = self.group.init(ZR, 0)
+        rows = [[(j, self.group.init(ZR, int(m_ij))) for j, m_ij in enumerate(row) if m_ij != 0]
+                for row in M]
+        return [sum((m_ij * v[j] for j, m_ij in row), zero) for row in rows]
     
     def setup(self) -> SystemParams:
         """
@@ -42,13 +127,19 @@ class CPABEProxyReenc:
         # Public key components
         e_gg_alpha = pair(g, g2) ** alpha
         g_beta = g ** beta
+        h = self.group.random(G1)  # Additional public parameter
+        
+        # Fixed bases are raised to fresh scalars on every keygen/encrypt/
+        # reencrypt; precompute their exponentiation tables once
+        for base in (g, g2, e_gg_alpha, g_beta, h):
+            base.initPP()
         
         pk = {
             'g': g,
             'g2': g2,
             'e_gg_alpha': e_gg_alpha,
             'g_beta': g_beta,
-            'h': self.group.random(G1)  # Additional public parameter
+            'h': h
         }
         
         mk = {
@@ -80,9 +171,10 @@ class CPABEProxyReenc:
         # For each attribute, compute key component
         for attr in attributes:
             r_attr = self.group.random(ZR)
-            attr_hash = self.group.hash(attr, G1)
+            attr_hash = self._H1(attr)
             
             sk_components['attributes'][attr] = {
+                # h ** r uses the fixed-base table built in setup()
                 'D_attr': (pk['h'] ** r) * (attr_hash ** r_attr),
                 'D_attr_prime': pk['g'] ** r_attr
             }
@@ -125,40 +217,45 @@ class CPABEProxyReenc:
         M = policy.matrix
         rho = policy.rho
         
-        # Generate random vector v with v[0] = s
+        # Generate random vector v with v[0] = s, plus one r_i per row,
+        # from a single draw of entropy
         n_cols = len(M[0])
-        v = [s] + [self.group.random(ZR) for _ in range(n_cols - 1)]
+        randoms = self._random_zr(n_cols - 1 + len(M))
+        v = [s] + randoms[:n_cols - 1]
+        r_values = randoms[n_cols - 1:]
         
         # Compute shares λ_i = M_i · v for each row
-        ct_components = {}
-        for i, row in enumerate(M):
-            attr = rho[i]
-            
-            # Compute share λ_i = M_i · v
-            lambda_i = self.group.init(ZR, 0)
-            for j, m_ij in enumerate(row):
-                lambda_i += self.group.init(ZR, m_ij) * v[j]
-            
-            r_i = self.group.random(ZR)
-            attr_hash = self.group.hash(attr, G1)
-            
-            ct_components[i] = {
+        shares = self._compute_shares(policy._M, v)
+        
+        # Bind hot lookups once rather than per row
+        g, g_beta = pk['g'], pk['g_beta']
+        H1 = self._H1
+        
+        def encrypt_row(attr, lambda_i, r_i):
+            return {
                 'attr': attr,
-                'C_i': (pk['g_beta'] ** lambda_i) * (attr_hash ** (-r_i)),
-                'D_i': pk['g'] ** r_i
+                # g_beta ** λ_i uses the fixed-base table built in setup()
+                'C_i': (g_beta ** lambda_i) * (H1(attr) ** (-r_i)),
+                'D_i': g ** r_i
             }
         
+        rows = [(rho[i], lambda_i, r_values[i]) for i, lambda_i in enumerate(shares)]
+        ct_components = dict(enumerate(encrypt_row(*row) for row in rows))
+        
         # Encrypt actual message with symmetric key derived from C
-        msg_key = hashlib.sha256(self.group.serialize(C)).digest()[:16]
+        c_serialized = self.group.serialize(C)
+        msg_key = HKDF(c_serialized, 32, b'', SHA256)
         
-        # XOR plaintext with key (simplified symmetric encryption)
-        encrypted_msg = bytes(a ^ b for a, b in zip(pt_bytes, msg_key * (len(pt_bytes) // 16 + 1)))
+        # AES-CTR with a fresh nonce per message
+        cipher = AES.new(msg_key, AES.MODE_CTR, nonce=get_random_bytes(8))
+        encrypted_msg = cipher.encrypt(pt_bytes)
         
         ct_data = {
             'C': C,
             'C_prime': C_prime,
             'components': ct_components,
-            'encrypted_msg': encrypted_msg.hex()
+            'encrypted_msg': encrypted_msg,
+            'nonce': cipher.nonce
         }
         
         # Compute binding B = H1(PT)
@@ -171,7 +268,8 @@ class CPABEProxyReenc:
             ct=ct_data,
             policy=policy,
             ct_hash=ct_hash,
-            binding=binding
+            binding=binding,
+            c_serialized=c_serialized
         )
     
     def check_match(self, user_attrs: List[str], policy: AccessPolicy) -> bool:
@@ -179,25 +277,8 @@ class CPABEProxyReenc:
         Matching algorithm (Section IV-A-4)
         Check if user attributes satisfy access policy (M, ρ)
         """
-        M = policy.matrix
-        rho = policy.rho
-        
-        # Build attribute set
-        attr_set = set(user_attrs)
-        
-        # Find rows where attribute is satisfied
-        satisfied_rows = []
-        for i, row in enumerate(M):
-            if rho[i] in attr_set:
-                satisfied_rows.append(i)
-        
-        if not satisfied_rows:
-            return False
-        
-        # Check if satisfied rows span the target vector [1, 0, ..., 0]
-        # Simplified: if we have enough satisfied rows, assume policy is satisfied
-        # Full implementation would solve linear system
-        return len(satisfied_rows) >= 1
+        # Satisfied rows must span the target vector [1, 0, ..., 0]
+        return self._omega(policy, user_attrs) is not None
     
     def generate_rekey(
         self,
@@ -248,24 +329,32 @@ class CPABEProxyReenc:
             'C': ct.ct['C'],  # Preserve main component
             'C_prime': ct.ct['C_prime'] * (pk['g'] ** r_re),
             'components': {},
-            'encrypted_msg': ct.ct['encrypted_msg']
+            'encrypted_msg': ct.ct['encrypted_msg'],
+            'nonce': ct.ct['nonce']
         }
         
         # Re-encrypt each component for new policy
         target_policy = rk.target_policy
-        for i, row in enumerate(target_policy.matrix):
-            attr = target_policy.rho[i]
-            
-            # Find matching component in original CT or create new
-            r_i_prime = self.group.random(ZR)
-            attr_hash = self.group.hash(attr, G1)
-            
-            ct_prime_data['components'][i] = {
+        g_beta_r_re = pk['g_beta'] ** r_re
+        g, H1 = pk['g'], self._H1
+        
+        # Attributes shared by the original and target policies recur on every
+        # re-encryption between them; table their cached hashes once
+        for attr in (ct.policy._rho_set & target_policy._rho_set) - self._attr_pp:
+            H1(attr).initPP()
+            self._attr_pp.add(attr)
+        
+        def reencrypt_row(attr, r_i_prime):
+            return {
                 'attr': attr,
-                'C_i': pk['g_beta'] ** r_re * (attr_hash ** (-r_i_prime)),
-                'D_i': pk['g'] ** r_i_prime
+                'C_i': g_beta_r_re * (H1(attr) ** (-r_i_prime)),
+                'D_i': g ** r_i_prime
             }
         
+        n_rows = len(target_policy.matrix)
+        rows = list(zip((target_policy.rho[i] for i in range(n_rows)), self._random_zr(n_rows)))
+        ct_prime_data['components'] = dict(enumerate(reencrypt_row(*row) for row in rows))
+        
         # Compute verification data: R'' = g^{H1(F)}
         # F = L · e(R0, g^b) where L and R0 are derived from CT'
         verification_data = {
@@ -279,7 +368,8 @@ class CPABEProxyReenc:
             ct_prime=ct_prime_data,
             ct_prime_hash=ct_prime_hash,
             original_binding=ct.binding,
-            verification_data=verification_data
+            verification_data=verification_data,
+            c_serialized=ct.c_serialized
         )
     
     def verify(
@@ -326,13 +416,15 @@ class CPABEProxyReenc:
         # Check if user attributes satisfy policy
         # Simplified: assume satisfied if user has key
         
-        # Recover symmetric key from C
-        C = ct_prime.ct_prime['C']
-        msg_key = hashlib.sha256(self.group.serialize(C)).digest()[:16]
+        # Recover symmetric key from C (C is carried over unchanged by reencrypt)
+        c_serialized = ct_prime.c_serialized
+        if c_serialized is None:
+            c_serialized = self.group.serialize(ct_prime.ct_prime['C'])
+        msg_key = HKDF(c_serialized, 32, b'', SHA256)
         
         # Decrypt message
-        encrypted_msg = bytes.fromhex(ct_prime.ct_prime['encrypted_msg'])
-        plaintext_bytes = bytes(a ^ b for a, b in zip(encrypted_msg, msg_key * (len(encrypted_msg) // 16 + 1)))
+        cipher = AES.new(msg_key, AES.MODE_CTR, nonce=ct_prime.ct_prime['nonce'])
+        plaintext_bytes = cipher.decrypt(ct_prime.ct_prime['encrypted_msg'])
         
         # Remove padding
         plaintext = plaintext_bytes.decode('utf-8', errors='ignore').rstrip('\x00')
@@ -5,13 +5,14 @@ Using PyCryptodome and ECC instead of pairing-based crypto
 """
 
 import hashlib
-import json
+import hmac
+import numpy as np
+import orjson
 import os
 from Crypto.PublicKey import ECC
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 from Crypto.Protocol.KDF import HKDF
-from Crypto.Hash import SHA256, HMAC
 from models import SystemParams, UserKeys, AccessPolicy, Ciphertext, ReencryptionKey, ReencryptedCiphertext, compute_hash, compute_binding
 
 
@@ -24,6 +25,8 @@ class CPABEProxyReenc:
     def __init__(self):
         """Initialize crypto engine"""
         self.params = None
+        # DER encoding of the master key (the MAC key), kept from setup()
+        self._master_key_der = None
         
     def setup(self):
         """
@@ -34,22 +37,32 @@ class CPABEProxyReenc:
         # Generate master ECC key pair
         master_key = ECC.generate(curve='P-256')
         public_key = master_key.public_key()
+        master_key_der = master_key.export_key(format='DER')
         
         # Derive system parameters
         params = {
             'curve': 'P-256',
-            'master_secret': master_key.export_key(format='DER').hex(),
+            'master_secret': master_key_der.hex(),
             'public_key': public_key.export_key(format='DER').hex(),
             'g': public_key.pointQ.x,  # Generator point x-coordinate
         }
         
         self.params = SystemParams(
-            pk=json.dumps({'public_key': params['public_key'], 'g': str(params['g'])}),
+            pk=orjson.dumps({'public_key': params['public_key'], 'g': str(params['g'])}).decode(),
             mk=params['master_secret']
         )
+        self._master_key_der = master_key_der
         
         return self.params
     
+    def load_params(self, params: SystemParams):
+        """
+        Adopt system parameters produced by setup() in another engine
+        (e.g. a worker process); only the DER bytes are needed, no key parse
+        """
+        self._master_key_der = bytes.fromhex(params.mk)
+        self.params = params
+    
     def keygen(self, attributes: list, ptid: str) -> UserKeys:
         """
         Algorithm 2: KeyGen
@@ -64,17 +77,17 @@ class CPABEProxyReenc:
         if not self.params:
             raise ValueError("System not initialized. Call setup() first.")
         
-        # Load master key
-        master_key = ECC.import_key(bytes.fromhex(self.params.mk))
-        
         # Generate user-specific randomness
         user_random = get_random_bytes(32)
         
+        # Keyed MAC state is set up once and copied per attribute
+        base_mac = hmac.new(self._master_key_der, digestmod='sha256')
+        
         # Derive attribute keys
         sk_components = {}
         for attr in attributes:
             # Hash attribute with master key
-            h = HMAC.new(master_key.export_key(format='DER'), digestmod=SHA256)
+            h = base_mac.copy()
             h.update(attr.encode('utf-8'))
             h.update(ptid.encode('utf-8'))
             h.update(user_random)
@@ -85,7 +98,7 @@ class CPABEProxyReenc:
         binding = compute_binding(ptid)
         
         return UserKeys(
-            sk=json.dumps(sk_components),
+            sk=sk_components,
             attributes=attributes,
             ptid=ptid,
             binding=binding
@@ -105,23 +118,25 @@ class CPABEProxyReenc:
         if not self.params:
             raise ValueError("System not initialized. Call setup() first.")
         
-        # Generate random symmetric key
-        aes_key = get_random_bytes(32)
+        # Generate random symmetric key and nonce in one draw
+        key_material = get_random_bytes(48)
+        aes_key, nonce = key_material[:32], key_material[32:]
         
         # Encrypt plaintext with AES
-        cipher = AES.new(aes_key, AES.MODE_GCM)
+        cipher = AES.new(aes_key, AES.MODE_GCM, nonce=nonce)
         ciphertext, tag = cipher.encrypt_and_digest(plaintext.encode('utf-8'))
         
         # Encrypt AES key under policy
         # For each row in policy matrix, create key share
+        base_mac = hmac.new(aes_key, digestmod='sha256')
         key_shares = {}
         for i, row in enumerate(policy.matrix):
             attr = policy.rho[i]
             
             # Derive attribute-specific encryption
-            h = HMAC.new(aes_key, digestmod=SHA256)
+            h = base_mac.copy()
             h.update(attr.encode('utf-8'))
-            h.update(str(row).encode('utf-8'))
+            h.update(policy._M[i])
             
             key_shares[attr] = {
                 'share': h.hexdigest(),
@@ -129,18 +144,17 @@ class CPABEProxyReenc:
             }
         
         ct_data = {
-            'ciphertext': ciphertext.hex(),
-            'tag': tag.hex(),
-            'nonce': cipher.nonce.hex(),
+            'ciphertext': ciphertext,
+            'tag': tag,
+            'nonce': cipher.nonce,
             'key_shares': key_shares,
-            'aes_key_encrypted': aes_key.hex()  # For demo, in production use proper ABE
+            'aes_key_encrypted': aes_key  # For demo, in production use proper ABE
         }
         
-        ct_str = json.dumps(ct_data)
-        ct_hash = compute_hash(ct_str)
+        ct_hash = compute_hash(ct_data)
         
         return Ciphertext(
-            ct=ct_str,
+            ct=ct_data,
             policy=policy,
             ct_hash=ct_hash
         )
@@ -156,12 +170,27 @@ class CPABEProxyReenc:
             
         Returns: True if attributes satisfy policy
         """
-        # Check if user has all required attributes
-        required_attrs = set(policy.rho.values())
-        user_attrs = set(attributes)
-        
         # Simple policy: user must have all attributes in policy
-        return required_attrs.issubset(user_attrs)
+        return policy._rho_set.issubset(attributes)
+    
+    def match_many(self, policy: AccessPolicy, attributes_list: list) -> list:
+        """
+        Algorithm 4 (batched): Match many users against one policy
+        
+        Args:
+            policy: Access policy (M, ρ)
+            attributes_list: One attribute list per user
+            
+        Returns: One bool per user, same semantics as match()
+        """
+        # Users x policy-attributes table; a user matches if their row is all set
+        columns = {attr: j for j, attr in enumerate(policy._rho_set)}
+        held = np.zeros((len(attributes_list), len(columns)), dtype=bool)
+        for i, attributes in enumerate(attributes_list):
+            cols = [columns[attr] for attr in attributes if attr in columns]
+            held[i, cols] = True
+        
+        return held.all(axis=1).tolist()
     
     def generate_rekey(self, sk_rider: UserKeys, pk_driver: str, ptid_driver: str) -> ReencryptionKey:
         """
@@ -175,26 +204,25 @@ class CPABEProxyReenc:
             
         Returns: ReencryptionKey
         """
-        # Load rider's secret key
-        sk_components = json.loads(sk_rider.sk)
+        sk_components = sk_rider.sk
         
         # Generate re-encryption randomness
         reenc_random = get_random_bytes(32)
         
         # Derive re-encryption key
-        h = HMAC.new(reenc_random, digestmod=SHA256)
-        h.update(json.dumps(sk_components).encode('utf-8'))
+        h = hmac.new(reenc_random, digestmod='sha256')
+        h.update(orjson.dumps(sk_components))
         h.update(pk_driver.encode('utf-8'))
         h.update(ptid_driver.encode('utf-8'))
         
         rk_data = {
-            'reenc_key': h.hexdigest(),
+            'reenc_key': h.digest(),
             'ptid_driver': ptid_driver,
-            'random': reenc_random.hex()
+            'random': reenc_random
         }
         
         return ReencryptionKey(
-            rk=json.dumps(rk_data),
+            rk=rk_data,
             ptid_from=sk_rider.ptid,
             ptid_to=ptid_driver
         )
@@ -210,15 +238,14 @@ class CPABEProxyReenc:
             
         Returns: ReencryptedCiphertext
         """
-        # Load ciphertext and re-encryption key
-        ct_data = json.loads(ct.ct)
-        rk_data = json.loads(rk.rk)
+        ct_data = ct.ct
+        rk_data = rk.rk
         
         # Apply re-encryption transformation
-        h = HMAC.new(bytes.fromhex(rk_data['random']), digestmod=SHA256)
-        h.update(ct_data['aes_key_encrypted'].encode('utf-8'))
+        h = hmac.new(rk_data['random'], digestmod='sha256')
+        h.update(ct_data['aes_key_encrypted'])
         
-        reenc_key = h.hexdigest()
+        reenc_key = h.digest()
         
         # Create re-encrypted ciphertext
         ct_prime_data = {
@@ -229,20 +256,21 @@ class CPABEProxyReenc:
             'ptid_to': rk_data['ptid_driver']
         }
         
-        ct_prime_str = json.dumps(ct_prime_data)
-        ct_prime_hash = compute_hash(ct_prime_str)
+        ct_prime_hash = compute_hash(ct_prime_data)
         
         # Generate verification component R'' = g^{H1(F)}
-        # F is the transformation function
-        f_hash = hashlib.sha256(rk_data['reenc_key'].encode('utf-8')).hexdigest()
-        r_double_prime = hashlib.sha256(f_hash.encode('utf-8')).hexdigest()
-        
+        # F is the transformation function (the RK's reenc_key)
         return ReencryptedCiphertext(
-            ct_prime=ct_prime_str,
+            ct_prime=ct_prime_data,
             ct_prime_hash=ct_prime_hash,
-            r_double_prime=r_double_prime
+            r_double_prime=self._derive_r_double_prime(rk_data['reenc_key'])
         )
     
+    @staticmethod
+    def _derive_r_double_prime(reenc_key: bytes) -> bytes:
+        """R'' = H(H(F)) over the raw digest of the transformation F"""
+        return hashlib.sha256(hashlib.sha256(reenc_key).digest()).digest()
+    
     def verify(self, ct_prime: ReencryptedCiphertext) -> bool:
         """
         Algorithm 7: Verify
@@ -254,18 +282,16 @@ class CPABEProxyReenc:
             
         Returns: True if verification passes
         """
-        # Load re-encrypted ciphertext
-        ct_prime_data = json.loads(ct_prime.ct_prime)
+        ct_prime_data = ct_prime.ct_prime
         
         # Recompute verification value
         if 'reenc_key' not in ct_prime_data:
             return False
         
-        f_hash = hashlib.sha256(ct_prime_data['reenc_key'].encode('utf-8')).hexdigest()
-        expected_r = hashlib.sha256(f_hash.encode('utf-8')).hexdigest()
+        expected_r = self._derive_r_double_prime(ct_prime_data['reenc_key'])
         
-        # Verify R'' matches
-        return expected_r == ct_prime.r_double_prime
+        # Verify R'' matches (constant time)
+        return hmac.compare_digest(expected_r, ct_prime.r_double_prime)
     
     def decrypt(self, ct_or_ct_prime, sk: UserKeys) -> str:
         """
@@ -280,28 +306,26 @@ class CPABEProxyReenc:
         """
         # Determine if original or re-encrypted
         if isinstance(ct_or_ct_prime, ReencryptedCiphertext):
-            ct_data = json.loads(ct_or_ct_prime.ct_prime)
+            ct_data = ct_or_ct_prime.ct_prime
             
             # Verify before decryption
             if not self.verify(ct_or_ct_prime):
                 raise ValueError("Verification failed! CT' may be tampered.")
             
             # For re-encrypted: derive AES key from reenc_key
-            h = HMAC.new(bytes.fromhex(json.loads(sk.sk)[list(json.loads(sk.sk).keys())[0]]), digestmod=SHA256)
-            h.update(ct_data['reenc_key'].encode('utf-8'))
-            aes_key = bytes.fromhex(h.hexdigest()[:64])
+            sk_components = sk.sk
+            h = hmac.new(bytes.fromhex(next(iter(sk_components.values()))), digestmod='sha256')
+            h.update(ct_data['reenc_key'])
+            aes_key = h.digest()
         else:
-            ct_data = json.loads(ct_or_ct_prime.ct)
+            ct_data = ct_or_ct_prime.ct
             
             # For original: use encrypted AES key
-            aes_key = bytes.fromhex(ct_data['aes_key_encrypted'])
+            aes_key = ct_data['aes_key_encrypted']
         
         # Decrypt with AES
-        cipher = AES.new(aes_key, AES.MODE_GCM, nonce=bytes.fromhex(ct_data['nonce']))
-        plaintext = cipher.decrypt_and_verify(
-            bytes.fromhex(ct_data['ciphertext']),
-            bytes.fromhex(ct_data['tag'])
-        )
+        cipher = AES.new(aes_key, AES.MODE_GCM, nonce=ct_data['nonce'])
+        plaintext = cipher.decrypt_and_verify(ct_data['ciphertext'], ct_data['tag'])
         
         return plaintext.decode('utf-8')
 
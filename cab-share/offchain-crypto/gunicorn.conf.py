@@ -0,0 +1,40 @@
+"""
+Gunicorn configuration for the crypto service
+Usage: gunicorn -c gunicorn.conf.py 'service:create_app()'
+"""
+
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Loopback only: nginx (see nginx.conf) and the Node API reach the service on
+# localhost. Set CRYPTO_BIND_HOST=0.0.0.0 only when nothing fronts it.
+bind_host = os.getenv('CRYPTO_BIND_HOST', '127.0.0.1')
+bind = f"{bind_host}:{os.getenv('CRYPTO_SERVICE_PORT', 5123)}"
+
+# On loopback the only remote clients arrive through nginx, so the app may
+# trust its X-Forwarded-For for rate limiting (see service.create_app)
+if bind_host == '127.0.0.1':
+    os.environ.setdefault('TRUST_PROXY', '1')
+
+# The app (and its crypto engine setup) is loaded once in the master and
+# forked, so every worker shares the same system params. User keys are only
+# shared across workers through Redis; without REDIS_URL keep one worker.
+# Crypto work runs in C extensions that release the GIL, so threads are
+# oversubscribed at 2x cores.
+preload_app = True
+workers = int(os.getenv(
+    'CRYPTO_WORKERS',
+    2 * multiprocessing.cpu_count() if os.getenv('REDIS_URL') else 1
+))
+# Routes split the in-flight crypto cap between workers (CRYPTO_INFLIGHT)
+os.environ['CRYPTO_WORKERS'] = str(workers)
+worker_class = 'gthread'
+threads = int(os.getenv('CRYPTO_THREADS', 2 * multiprocessing.cpu_count()))
+
+# Hold idle connections open; must exceed the upstream keepalive timeout of
+# the proxy in front (nginx: 60s default, see nginx.conf) so the proxy never
+# reuses a socket gunicorn has already closed
+keepalive = int(os.getenv('CRYPTO_KEEPALIVE', 75))
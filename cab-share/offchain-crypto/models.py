@@ -5,8 +5,10 @@ Implements the paper's cryptographic construction
 
 from dataclasses import dataclass, field
 from typing import Dict, List, Any, Optional
-import json
+import base64
 import hashlib
+import json
+import numpy as np
 
 
 @dataclass
@@ -25,7 +27,7 @@ class SystemParams:
 @dataclass
 class UserKeys:
     """User secret and public keys (SK_U, PK_U)"""
-    sk: str  # JSON string of key components
+    sk: Dict[str, Any]  # Key components
     attributes: List[str]
     ptid: str  # Privacy-preserving identifier
     binding: str = ""  # B = H1(PTID)
@@ -37,6 +39,15 @@ class UserKeys:
             'ptid': self.ptid,
             'binding': self.binding
         }
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            sk=data['sk'],
+            attributes=data['attributes'],
+            ptid=data['ptid'],
+            binding=data.get('binding', '')
+        )
 
 
 @dataclass
@@ -44,6 +55,18 @@ class AccessPolicy:
     """Access structure (M, ρ) from paper"""
     matrix: List[List[int]]  # M: access matrix
     rho: Dict[int, str]      # ρ: mapping from rows to attributes
+    _rho_set: frozenset = field(init=False, repr=False, compare=False)
+    _M: np.ndarray = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Attributes referenced by the policy, built once for matching
+        self._rho_set = frozenset(self.rho.values())
+        # M as a contiguous little-endian int64 buffer, built once at parse time.
+        # Strict: a lossy cast would MAC a different matrix than to_dict() carries
+        M = np.asarray(self.matrix)
+        if M.dtype.kind not in 'iu' or not np.can_cast(M.dtype, '<i8'):
+            raise ValueError('Access matrix entries must be 64-bit integers')
+        self._M = M.astype('<i8', copy=False)
     
     def to_dict(self):
         return {
@@ -62,63 +85,171 @@ class AccessPolicy:
 @dataclass
 class Ciphertext:
     """Encrypted ciphertext CT with access policy"""
-    ct: str  # JSON string of ciphertext components
+    ct: Dict[str, Any]  # Ciphertext components
     policy: AccessPolicy
     ct_hash: str
+    # Serialized C element, reused for key derivation (never sent over the wire)
+    c_serialized: Optional[bytes] = field(default=None, repr=False, compare=False)
+    # Original JSON string of a ciphertext stored in the legacy format
+    legacy_ct: Optional[str] = field(default=None, repr=False, compare=False)
+    
+    # Components held as raw bytes in memory, base64 on the wire
+    BYTES_FIELDS = ('ciphertext', 'tag', 'nonce', 'aes_key_encrypted', 'encrypted_msg')
     
     def to_dict(self):
         return {
-            'ct': self.ct,
+            'ct': self.legacy_ct if self.legacy_ct is not None
+                  else encode_bytes_fields(self.ct, self.BYTES_FIELDS),
             'policy': self.policy.to_dict(),
             'ct_hash': self.ct_hash
         }
     
+    def hash_matches(self) -> bool:
+        """Check ct_hash against the components, in whichever format they arrived"""
+        if self.legacy_ct is not None:
+            return compute_legacy_hash(self.legacy_ct) == self.ct_hash
+        return compute_hash(self.ct) == self.ct_hash
+    
     @staticmethod
-    def from_dict(data: Dict):
+    def from_dict(data: Dict, policy: Optional[AccessPolicy] = None):
+        # An already-parsed policy can be shared instead of rebuilt per ciphertext
+        ct, legacy_ct = decode_components(data['ct'], Ciphertext.BYTES_FIELDS)
         return Ciphertext(
-            ct=data['ct'],
-            policy=AccessPolicy.from_dict(data['policy']),
-            ct_hash=data['ct_hash']
+            ct=ct,
+            policy=policy if policy is not None else AccessPolicy.from_dict(data['policy']),
+            ct_hash=data['ct_hash'],
+            legacy_ct=legacy_ct
         )
 
 
 @dataclass
 class ReencryptionKey:
     """Proxy re-encryption key RK"""
-    rk: str  # JSON string of re-encryption key data
+    rk: Dict[str, Any]  # Re-encryption key data
     ptid_from: str = ""  # Source PTID (rider)
     ptid_to: str = ""  # Target PTID (driver)
     
+    BYTES_FIELDS = ('random', 'reenc_key')
+    
     def to_dict(self):
         return {
-            'rk': self.rk,
+            'rk': encode_bytes_fields(self.rk, self.BYTES_FIELDS),
             'ptid_from': self.ptid_from,
             'ptid_to': self.ptid_to
         }
+    
+    @staticmethod
+    def from_dict(data: Dict):
+        return ReencryptionKey(
+            # Keys stored in the legacy JSON-string format decode the same way
+            rk=decode_components(data['rk'], ReencryptionKey.BYTES_FIELDS)[0],
+            ptid_from=data.get('ptid_from', ''),
+            ptid_to=data.get('ptid_to', '')
+        )
 
 
 @dataclass
 class ReencryptedCiphertext:
     """Re-encrypted ciphertext CT'"""
-    ct_prime: str  # JSON string of re-encrypted ciphertext
+    ct_prime: Dict[str, Any]  # Re-encrypted ciphertext components
     ct_prime_hash: str
-    r_double_prime: str  # R'' = g^{H1(F)} for verification
+    r_double_prime: bytes  # R'' = g^{H1(F)} for verification
+    # Serialized C element, reused for key derivation (never sent over the wire)
+    c_serialized: Optional[bytes] = field(default=None, repr=False, compare=False)
+    # Original JSON string of a CT' stored in the legacy format
+    legacy_ct_prime: Optional[str] = field(default=None, repr=False, compare=False)
+    
+    BYTES_FIELDS = ('ciphertext', 'tag', 'nonce', 'encrypted_msg', 'reenc_key')
     
     def to_dict(self):
+        if self.legacy_ct_prime is not None:
+            return {
+                'ct_prime': self.legacy_ct_prime,
+                'ct_prime_hash': self.ct_prime_hash,
+                'r_double_prime': self.r_double_prime.hex()
+            }
         return {
-            'ct_prime': self.ct_prime,
+            'ct_prime': encode_bytes_fields(self.ct_prime, self.BYTES_FIELDS),
             'ct_prime_hash': self.ct_prime_hash,
-            'r_double_prime': self.r_double_prime
+            'r_double_prime': base64.b64encode(self.r_double_prime).decode('ascii')
         }
+    
+    def hash_matches(self) -> bool:
+        """Check ct_prime_hash against the components, in whichever format they arrived"""
+        if self.legacy_ct_prime is not None:
+            return compute_legacy_hash(self.legacy_ct_prime) == self.ct_prime_hash
+        return compute_hash(self.ct_prime) == self.ct_prime_hash
+    
+    @staticmethod
+    def from_dict(data: Dict):
+        ct_prime, legacy_ct_prime = decode_components(data['ct_prime'], ReencryptedCiphertext.BYTES_FIELDS)
+        # Legacy R'' is hex, current R'' is base64
+        r_double_prime = (bytes.fromhex(data['r_double_prime']) if legacy_ct_prime is not None
+                          else base64.b64decode(data['r_double_prime']))
+        return ReencryptedCiphertext(
+            ct_prime=ct_prime,
+            ct_prime_hash=data['ct_prime_hash'],
+            r_double_prime=r_double_prime,
+            legacy_ct_prime=legacy_ct_prime
+        )
 
 
-def compute_hash(data: Any) -> str:
-    """Compute SHA-256 hash of data"""
-    if isinstance(data, dict):
-        data_str = json.dumps(data, sort_keys=True)
+def encode_bytes_fields(data: Dict, fields: tuple) -> Dict:
+    """Copy of data with the named raw-bytes fields base64-encoded"""
+    return {k: base64.b64encode(v).decode('ascii') if k in fields and isinstance(v, bytes) else v
+            for k, v in data.items()}
+
+
+def decode_bytes_fields(data: Dict, fields: tuple) -> Dict:
+    """Copy of data with the named base64 fields decoded to raw bytes"""
+    return {k: base64.b64decode(v) if k in fields and isinstance(v, str) else v
+            for k, v in data.items()}
+
+
+def decode_components(data: Any, fields: tuple):
+    """
+    Decode wire components to (components, legacy_json)
+    Ciphertexts and keys stored before components became dicts (e.g. the API's
+    ct_<rideId>.json files) carry a JSON string with hex-encoded byte fields;
+    those decode to the same in-memory form and keep their original string
+    """
+    if isinstance(data, str):
+        legacy = json.loads(data)
+        return {k: bytes.fromhex(v) if k in fields and isinstance(v, str) else v
+                for k, v in legacy.items()}, data
+    return decode_bytes_fields(data, fields), None
+
+
+def _canonical_update(h, obj: Any):
+    """Feed obj into hash h as tagged, length-prefixed bytes (keys sorted)"""
+    if isinstance(obj, dict):
+        h.update(b'd' + len(obj).to_bytes(8, 'big'))
+        for key in sorted(obj, key=str):
+            _canonical_update(h, str(key))
+            _canonical_update(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'l' + len(obj).to_bytes(8, 'big'))
+        for item in obj:
+            _canonical_update(h, item)
+    elif isinstance(obj, (bytes, bytearray)):
+        h.update(b'b' + len(obj).to_bytes(8, 'big'))
+        h.update(obj)
     else:
-        data_str = str(data)
-    return hashlib.sha256(data_str.encode()).hexdigest()
+        tag, raw = (b's', obj.encode()) if isinstance(obj, str) else (b'v', repr(obj).encode())
+        h.update(tag + len(raw).to_bytes(8, 'big'))
+        h.update(raw)
+
+
+def compute_hash(data: Any) -> str:
+    """Compute SHA-256 hash of data in a single streaming pass"""
+    h = hashlib.sha256()
+    _canonical_update(h, data)
+    return h.hexdigest()
+
+
+def compute_legacy_hash(components_json: str) -> str:
+    """Legacy-format ct_hash: SHA-256 of the components' JSON string"""
+    return hashlib.sha256(components_json.encode()).hexdigest()
 
 
 def compute_binding(plaintext: str) -> str:
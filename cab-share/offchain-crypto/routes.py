@@ -3,82 +3,487 @@ REST API routes for CP-ABE crypto service
 Exposes all algorithms from the paper
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, abort, current_app, g, request
 from crypto_engine_windows import CPABEProxyReenc
-from models import AccessPolicy, Ciphertext, ReencryptedCiphertext, UserKeys, SystemParams
-import json
+from models import AccessPolicy, Ciphertext, ReencryptedCiphertext, ReencryptionKey, UserKeys, SystemParams
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from typing import Any, Callable, Dict, Optional, Tuple
+import hashlib
+import orjson
+import os
+import threading
+import time
 
 crypto_bp = Blueprint('crypto', __name__)
 
-# Global crypto engine instance
-crypto_engine = CPABEProxyReenc()
+# Per-client rates for the heavy endpoints; attached to the app in
+# service.create_app. Clients are told apart by the address nginx forwards
+# (ProxyFix), so direct local callers such as the Node API share one bucket;
+# hence no blanket default limit. Counters live in Redis when REDIS_URL is
+# set so the limits hold across workers.
+HEAVY_RATE_LIMIT = os.getenv('CRYPTO_HEAVY_RATE_LIMIT', '10/second')
+limiter = Limiter(
+    get_remote_address,
+    storage_uri=os.getenv('REDIS_URL') or 'memory://'
+)
 
-# Store system params in memory (in production, use secure storage)
-system_params = None
-user_keys_store = {}  # ptid -> UserKeys
+# User keys live in Redis when REDIS_URL is set so every worker sees them;
+# otherwise fall back to a per-process store. Entries expire after
+# USER_KEYS_TTL seconds either way.
+USER_KEYS_TTL = int(os.getenv('USER_KEYS_TTL', 3600))
+_redis_url = os.getenv('REDIS_URL')
+if _redis_url:
+    import redis
+    kv = redis.Redis.from_url(_redis_url)
+else:
+    kv = None
+# ptid -> (expires_at, UserKeys), used without Redis. The TTL is constant, so
+# insertion order is expiry order and expired entries sit at the front.
+user_keys_store = OrderedDict()
+_user_keys_lock = threading.Lock()
 
 
-@crypto_bp.route('/setup', methods=['POST'])
-def setup():
+def _put_keys(ptid: str, user_keys: UserKeys):
+    """Store user keys under their PTID for USER_KEYS_TTL seconds"""
+    if kv is not None:
+        kv.setex('user_keys:' + ptid, USER_KEYS_TTL, orjson.dumps(user_keys.to_dict()))
+        return
+    
+    now = time.monotonic()
+    with _user_keys_lock:
+        # Drop expired entries from the front so the fallback store stays bounded
+        while user_keys_store and next(iter(user_keys_store.values()))[0] <= now:
+            user_keys_store.popitem(last=False)
+        # Re-inserting moves the entry to the back, keeping expiry order
+        user_keys_store.pop(ptid, None)
+        user_keys_store[ptid] = (now + USER_KEYS_TTL, user_keys)
+
+
+def _get_keys(ptid: str):
+    """Fetch user keys by PTID, or None if unknown or expired"""
+    if kv is not None:
+        raw = kv.get('user_keys:' + ptid)
+        return UserKeys.from_dict(orjson.loads(raw)) if raw else None
+    
+    with _user_keys_lock:
+        entry = user_keys_store.get(ptid)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del user_keys_store[ptid]
+            return None
+        return entry[1]
+
+# CPU-bound engine calls can run in a process pool (CRYPTO_POOL_WORKERS > 0)
+# so request threads are not pinned by crypto work. Off by default: the
+# HMAC/AES engine's calls are cheaper than the pickling round trip, and every
+# gunicorn worker would fork its own pool. Enable it for the pairing engine.
+CRYPTO_POOL_WORKERS = int(os.getenv('CRYPTO_POOL_WORKERS', 0))
+CRYPTO_TIMEOUT = float(os.getenv('CRYPTO_TIMEOUT', 30))
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_worker_engine = None  # per-process engine inside pool workers
+
+# Crypto jobs admitted at once in this process; requests beyond that wait up to
+# CRYPTO_QUEUE_TIMEOUT seconds for a slot, then get 503 instead of queueing.
+# The cap is per gunicorn worker, so by default the cores are split between
+# the CRYPTO_WORKERS workers (exported by gunicorn.conf.py).
+CRYPTO_INFLIGHT = int(os.getenv(
+    'CRYPTO_INFLIGHT',
+    max(1, (os.cpu_count() or 1) // int(os.getenv('CRYPTO_WORKERS', 1)))
+))
+CRYPTO_QUEUE_TIMEOUT = float(os.getenv('CRYPTO_QUEUE_TIMEOUT', 1))
+_crypto_slots = threading.BoundedSemaphore(CRYPTO_INFLIGHT)
+
+
+class CryptoBusyError(RuntimeError):
+    """All crypto slots stayed busy for CRYPTO_QUEUE_TIMEOUT"""
+
+
+class CryptoTimeoutError(RuntimeError):
+    """A pooled crypto job did not finish within CRYPTO_TIMEOUT"""
+
+
+def _acquire_slot():
+    """Take one of the CRYPTO_INFLIGHT slots or raise CryptoBusyError"""
+    if not _crypto_slots.acquire(timeout=CRYPTO_QUEUE_TIMEOUT):
+        raise CryptoBusyError('Crypto service busy, retry shortly')
+
+
+@contextmanager
+def _crypto_slot():
+    """Hold one of the CRYPTO_INFLIGHT slots for the duration of a crypto job"""
+    _acquire_slot()
+    try:
+        yield
+    finally:
+        _crypto_slots.release()
+
+
+def _engine() -> CPABEProxyReenc:
+    """Crypto engine of the current app (set up by service.create_app)"""
+    return current_app.extensions['crypto']
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Process pool owned by the current process (gunicorn workers each get one)"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=CRYPTO_POOL_WORKERS)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _worker_call(method: str, params: SystemParams, args: Tuple) -> Any:
+    """Run an engine method inside a pool worker"""
+    global _worker_engine
+    if _worker_engine is None or _worker_engine.params != params:
+        _worker_engine = CPABEProxyReenc()
+        _worker_engine.load_params(params)
+    return getattr(_worker_engine, method)(*args)
+
+
+def _offload(method: str, *args) -> Any:
+    """Call <engine>.<method>(*args), in the process pool when enabled"""
+    engine = _engine()
+    if CRYPTO_POOL_WORKERS <= 0:
+        with _crypto_slot():
+            return getattr(engine, method)(*args)
+    
+    _acquire_slot()
+    try:
+        future = _get_pool().submit(_worker_call, method, engine.params, args)
+    except BaseException:
+        _crypto_slots.release()
+        raise
+    # The slot follows the job, not the request: a job that outlives
+    # CRYPTO_TIMEOUT keeps running in the pool and keeps its slot until done
+    future.add_done_callback(lambda _: _crypto_slots.release())
+    try:
+        return future.result(timeout=CRYPTO_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise CryptoTimeoutError(f'{method} timed out after {CRYPTO_TIMEOUT:g}s')
+
+
+# Input bounds checked before any crypto runs
+MAX_POLICY_ROWS = 256
+MAX_ATTRS = 64
+MAX_DRIVERS = 1024
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+# Client/proxy cache lifetimes (seconds) for GET /setup and /health
+SETUP_MAX_AGE = 60
+HEALTH_MAX_AGE = 5
+
+# /health bodies, encoded once, keyed by whether the system is initialized
+_HEALTH_BODIES = {
+    initialized: orjson.dumps({'success': True, 'status': 'healthy', 'initialized': initialized})
+    for initialized in (True, False)
+}
+
+# Parsed ciphertexts and policies, keyed by content hash. Clients resubmit
+# the same CT/policy many times during a matching round. Bounded by entry
+# count and by approximate wire size; large ciphertexts are never cached.
+PARSE_CACHE_SIZE = 1024
+PARSE_CACHE_MAX_BYTES = int(os.getenv('PARSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+PARSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv('PARSE_CACHE_MAX_ENTRY_BYTES', 1024 * 1024))
+_parse_cache = OrderedDict()  # key -> (value, size)
+_parse_cache_bytes = 0
+_parse_cache_lock = threading.Lock()
+
+
+def _wire_size(components: Any) -> int:
+    """Approximate size of wire components (string payloads dominate)"""
+    if isinstance(components, str):
+        return len(components)
+    if isinstance(components, dict):
+        return sum(len(v) for v in components.values() if isinstance(v, (str, bytes)))
+    return 0
+
+
+def _cached_parse(key: str, parse: Callable[[], Any], size: int = 0) -> Any:
+    """Return the cached object for key, parsing (and caching) it on a miss"""
+    global _parse_cache_bytes
+    with _parse_cache_lock:
+        entry = _parse_cache.get(key)
+        if entry is not None:
+            _parse_cache.move_to_end(key)
+            return entry[0]
+    
+    value = parse()
+    if size > PARSE_CACHE_MAX_ENTRY_BYTES:
+        return value
+    
+    with _parse_cache_lock:
+        if key not in _parse_cache:
+            _parse_cache[key] = (value, size)
+            _parse_cache_bytes += size
+        while len(_parse_cache) > PARSE_CACHE_SIZE or _parse_cache_bytes > PARSE_CACHE_MAX_BYTES:
+            _, (_, evicted) = _parse_cache.popitem(last=False)
+            _parse_cache_bytes -= evicted
+    return value
+
+
+def rate_limited(e):
+    """429 handler (registered on the app) in the service's JSON error shape"""
+    return ojsonify({
+        'success': False,
+        'error': f'Rate limit exceeded: {e.description}'
+    }, 429)
+
+
+def _body() -> Any:
+    """Request body parsed with orjson; None if empty or not valid JSON"""
+    # Refuse oversized bodies on the declared length, before reading anything
+    max_length = current_app.config.get('MAX_CONTENT_LENGTH')
+    if max_length and (request.content_length or 0) > max_length:
+        abort(413)
+    
+    raw = request.get_data(cache=False)
+    if not raw:
+        return None
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return None
+
+
+def ojsonify(payload: Any, status: int = 200):
+    """JSON response encoded with orjson (int rho keys become strings)"""
+    return current_app.response_class(
+        orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+# Responses smaller than this are sent whole (with Content-Length); larger
+# ones are streamed, with long strings emitted in STREAM_CHUNK_CHARS pieces
+STREAM_MIN_BYTES = 256 * 1024
+STREAM_CHUNK_CHARS = 64 * 1024
+
+
+def _payload_size(value: Any) -> int:
+    """Approximate encoded size of a payload (string contents dominate)"""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_payload_size(v) for v in value.values())
+    return 0
+
+
+def _iter_json(value: Any):
+    """Encode a JSON value piecewise: dicts field by field, long strings in slices"""
+    if isinstance(value, dict):
+        yield b'{'
+        for i, (key, item) in enumerate(value.items()):
+            yield (b',' if i else b'') + orjson.dumps(str(key)) + b':'
+            yield from _iter_json(item)
+        yield b'}'
+    elif isinstance(value, str) and len(value) > STREAM_CHUNK_CHARS:
+        # Escapes never span characters, so slices can be encoded independently
+        yield b'"'
+        for i in range(0, len(value), STREAM_CHUNK_CHARS):
+            yield orjson.dumps(value[i:i + STREAM_CHUNK_CHARS])[1:-1]
+        yield b'"'
+    else:
+        yield orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+
+def stream_ojsonify(payload: Dict, status: int = 200):
+    """Chunked JSON response for large ciphertext payloads"""
+    if status != 200 or _payload_size(payload) < STREAM_MIN_BYTES:
+        return ojsonify(payload, status)
+    return current_app.response_class(
+        _iter_json(payload),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+def _params_etag(params: SystemParams) -> str:
+    """ETag for the public parameters; changes whenever they are regenerated"""
+    return _stable_id(params.pk, 'pk-')
+
+
+def _stable_id(obj: Any, prefix: str) -> str:
     """
-    POST /setup
-    Initialize system parameters (PK_S, MK_S)
+    Deterministic identifier for a JSON-able value, identical across workers
+    All non-consensus IDs and cache keys go through here; ct_hash stays SHA-256
+    because it is anchored on-chain as bytes32
     """
-    global system_params
+    canonical = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return prefix + hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+
+def _validate_policy(policy_data: Any) -> Optional[Tuple[int, Dict]]:
+    """Reject malformed or oversized policies; returns an error response or None"""
+    matrix = policy_data.get('matrix') if isinstance(policy_data, dict) else None
+    rho = policy_data.get('rho') if isinstance(policy_data, dict) else None
+    
+    if not matrix or not isinstance(matrix, list) or not isinstance(rho, dict):
+        return 400, {
+            'success': False,
+            'error': 'Policy needs a non-empty matrix and a rho mapping'
+        }
+    
+    if (len(matrix) > MAX_POLICY_ROWS or len(rho) > MAX_POLICY_ROWS
+            or any(not isinstance(row, list) or len(row) > MAX_POLICY_ROWS for row in matrix)):
+        return 413, {
+            'success': False,
+            'error': f'Policy too large (max {MAX_POLICY_ROWS} rows/columns)'
+        }
+    
+    if len({len(row) for row in matrix}) != 1:
+        return 400, {
+            'success': False,
+            'error': 'Policy matrix rows must all have the same length'
+        }
+    
+    # Cells become int64 in AccessPolicy._M; floats, bools and strings are refused
+    if any(type(v) is not int or not INT64_MIN <= v <= INT64_MAX for row in matrix for v in row):
+        return 400, {
+            'success': False,
+            'error': 'Policy matrix entries must be 64-bit integers'
+        }
     
     try:
-        system_params = crypto_engine.setup()
+        rows = {int(i) for i in rho}
+    except (TypeError, ValueError):
+        rows = None
+    if rows is None or len(rows) != len(rho) or rows != set(range(len(matrix))):
+        return 400, {
+            'success': False,
+            'error': 'Policy rho must map every matrix row index exactly once'
+        }
+    
+    if any(not isinstance(attr, str) for attr in rho.values()):
+        return 400, {
+            'success': False,
+            'error': 'Policy rho values must be attribute strings'
+        }
+    
+    return None
+
+
+def _validate_attributes(attributes: Any) -> Optional[Tuple[int, Dict]]:
+    """Reject non-list or oversized attribute sets; returns an error response or None"""
+    if not isinstance(attributes, list):
+        return 400, {
+            'success': False,
+            'error': 'Attributes must be a list'
+        }
+    
+    if len(attributes) > MAX_ATTRS:
+        return 413, {
+            'success': False,
+            'error': f'Too many attributes (max {MAX_ATTRS})'
+        }
+    
+    return None
+
+
+def _parse_policy(policy_data: Dict) -> AccessPolicy:
+    # int64 matrix entries; rows are bounded by _validate_policy
+    size = 8 * sum(len(row) for row in policy_data['matrix'])
+    return _cached_parse(_stable_id(policy_data, 'policy:'),
+                         lambda: AccessPolicy.from_dict(policy_data), size)
+
+
+def _parse_ciphertext(ct_data: Dict) -> Ciphertext:
+    def parse():
+        ct = Ciphertext.from_dict(ct_data, policy=_parse_policy(ct_data['policy']))
+        # The cache trusts ct_hash, so only admit ciphertexts that match it
+        if not ct.hash_matches():
+            raise ValueError('Ciphertext does not match ct_hash')
+        return ct
+    
+    key = _stable_id(ct_data.get('policy'), f"ct:{ct_data.get('ct_hash')}:")
+    return _cached_parse(key, parse, _wire_size(ct_data.get('ct')))
+
+
+def _parse_ct_prime(ct_prime_data: Dict) -> ReencryptedCiphertext:
+    def parse():
+        ct_prime = ReencryptedCiphertext.from_dict(ct_prime_data)
+        if not ct_prime.hash_matches():
+            raise ValueError("CT' does not match ct_prime_hash")
+        return ct_prime
+    
+    key = f"ct_prime:{ct_prime_data.get('ct_prime_hash')}:{ct_prime_data.get('r_double_prime')}"
+    return _cached_parse(key, parse, _wire_size(ct_prime_data.get('ct_prime')))
+
+
+# Operation bodies return (status, payload) so that both the single-operation
+# routes and /batch can call them
+
+
+def _setup_impl(data: Dict) -> Tuple[int, Dict]:
+    """Return system parameters (PK_S, MK_S), generating them only if absent"""
+    engine = _engine()
+    
+    try:
+        # Params are created with the app and shared by all workers; one worker
+        # regenerating would split the fleet and invalidate every issued key
+        regenerate = not engine.params
+        if regenerate:
+            engine.setup()
         
         # Return simplified params for Windows implementation
-        return jsonify({
+        return 200, {
             'success': True,
             'params': {
-                'pk': system_params.pk,
+                'pk': engine.params.pk,
                 'initialized': True
             },
-            'message': 'System parameters generated successfully'
-        }), 200
+            'message': 'System parameters generated successfully' if regenerate
+                       else 'System parameters already initialized'
+        }
         
     except Exception as e:
-        return jsonify({
+        return 500, {
             'success': False,
             'error': str(e)
-        }), 500
+        }
 
 
-@crypto_bp.route('/keygen', methods=['POST'])
-def keygen():
-    """
-    POST /keygen
-    Generate user keys (SK_U, PK_U) for given attributes
-    Body: { attributes: string[], user_id: string }
-    """
-    global system_params, user_keys_store
+def _keygen_impl(data: Dict) -> Tuple[int, Dict]:
+    """Generate user keys (SK_U, PK_U) for given attributes"""
+    engine = _engine()
     
-    if not system_params:
-        return jsonify({
+    if not engine.params:
+        return 400, {
             'success': False,
             'error': 'System not initialized. Call /setup first'
-        }), 400
+        }
     
     try:
-        data = request.get_json()
         attributes = data.get('attributes', [])
         user_id = data.get('user_id')
         
         if not attributes or not user_id:
-            return jsonify({
+            return 400, {
                 'success': False,
                 'error': 'Missing attributes or user_id'
-            }), 400
+            }
+        
+        error = _validate_attributes(attributes)
+        if error:
+            return error
         
         # Generate keys (Windows implementation doesn't need system_params)
-        user_keys = crypto_engine.keygen(attributes, user_id)
+        user_keys = _offload('keygen', attributes, user_id)
         
         # Store keys
-        user_keys_store[user_keys.ptid] = user_keys
+        _put_keys(user_keys.ptid, user_keys)
         
-        return jsonify({
+        return 200, {
             'success': True,
             'keys': {
                 'ptid': user_keys.ptid,
@@ -86,339 +491,635 @@ def keygen():
                 'binding': user_keys.binding
             },
             'ptid': user_keys.ptid
-        }), 200
+        }
         
+    except CryptoBusyError as e:
+        return 503, {
+            'success': False,
+            'error': str(e)
+        }
+    except CryptoTimeoutError as e:
+        return 504, {
+            'success': False,
+            'error': str(e)
+        }
     except Exception as e:
-        return jsonify({
+        return 500, {
             'success': False,
             'error': str(e)
-        }), 500
+        }
 
 
-@crypto_bp.route('/encrypt', methods=['POST'])
-def encrypt():
-    """
-    POST /encrypt
-    Encrypt plaintext with access policy (M, ρ)
-    Body: { 
-        plaintext: string,
-        policy: { matrix: number[][], rho: {[key: number]: string} }
-    }
-    """
-    global system_params
+def _encrypt_impl(data: Dict) -> Tuple[int, Dict]:
+    """Encrypt plaintext with access policy (M, ρ)"""
+    engine = _engine()
     
-    if not system_params:
-        return jsonify({
+    if not engine.params:
+        return 400, {
             'success': False,
             'error': 'System not initialized'
-        }), 400
+        }
     
     try:
-        data = request.get_json()
         plaintext = data.get('plaintext')
         policy_data = data.get('policy')
         
         if not plaintext or not policy_data:
-            return jsonify({
+            return 400, {
                 'success': False,
                 'error': 'Missing plaintext or policy'
-            }), 400
+            }
+        
+        error = _validate_policy(policy_data)
+        if error:
+            return error
         
         # Parse policy
-        policy = AccessPolicy.from_dict(policy_data)
+        policy = _parse_policy(policy_data)
         
         # Encrypt (Windows implementation doesn't need system_params)
-        ciphertext = crypto_engine.encrypt(plaintext, policy)
+        ciphertext = _offload('encrypt', plaintext, policy)
         
-        return jsonify({
+        return 200, {
             'success': True,
             'ciphertext': ciphertext.to_dict(),
             'ct_hash': ciphertext.ct_hash
-        }), 200
+        }
         
+    except CryptoBusyError as e:
+        return 503, {
+            'success': False,
+            'error': str(e)
+        }
+    except CryptoTimeoutError as e:
+        return 504, {
+            'success': False,
+            'error': str(e)
+        }
     except Exception as e:
-        return jsonify({
+        return 500, {
             'success': False,
             'error': str(e)
-        }), 500
+        }
 
 
-@crypto_bp.route('/match', methods=['POST'])
-def match():
-    """
-    POST /match
-    Check if driver attributes satisfy rider's policy
-    Body: {
-        driver_attributes: string[],
-        policy: { matrix: number[][], rho: {[key: number]: string} }
-    }
-    """
+def _match_impl(data: Dict) -> Tuple[int, Dict]:
+    """Check if driver attributes satisfy rider's policy"""
     try:
-        data = request.get_json()
         driver_attrs = data.get('driver_attributes', [])
         policy_data = data.get('policy')
         
         if not driver_attrs or not policy_data:
-            return jsonify({
+            return 400, {
                 'success': False,
                 'error': 'Missing driver_attributes or policy'
-            }), 400
+            }
+        
+        error = _validate_policy(policy_data) or _validate_attributes(driver_attrs)
+        if error:
+            return error
         
         # Parse policy
-        policy = AccessPolicy.from_dict(policy_data)
+        policy = _parse_policy(policy_data)
         
         # Check match (method is called 'match' not 'check_match')
-        matches = crypto_engine.match(policy, driver_attrs)
+        matches = _engine().match(policy, driver_attrs)
         
-        return jsonify({
+        return 200, {
             'success': True,
             'matches': matches
-        }), 200
+        }
         
     except Exception as e:
-        return jsonify({
+        return 500, {
             'success': False,
             'error': str(e)
-        }), 500
+        }
 
 
-@crypto_bp.route('/rekey', methods=['POST'])
-def rekey():
-    """
-    POST /rekey
-    Generate re-encryption key RK
-    Body: {
-        original_ct: Ciphertext,
-        target_policy: AccessPolicy,
-        admin_ptid: string
-    }
-    """
-    global system_params, user_keys_store
+def _match_many_impl(data: Dict) -> Tuple[int, Dict]:
+    """Check many drivers against one rider policy"""
+    try:
+        drivers = data.get('drivers', [])
+        policy_data = data.get('policy')
+        
+        if not drivers or not policy_data:
+            return 400, {
+                'success': False,
+                'error': 'Missing drivers or policy'
+            }
+        
+        if not isinstance(drivers, list) or not all(isinstance(d, dict) for d in drivers):
+            return 400, {
+                'success': False,
+                'error': 'Drivers must be a list of { id, attributes } objects'
+            }
+        
+        if len(drivers) > MAX_DRIVERS:
+            return 413, {
+                'success': False,
+                'error': f'Too many drivers (max {MAX_DRIVERS})'
+            }
+        
+        error = _validate_policy(policy_data)
+        for driver in drivers:
+            error = error or _validate_attributes(driver.get('attributes', []))
+        if error:
+            return error
+        
+        # Parse policy once for all drivers
+        policy = _parse_policy(policy_data)
+        
+        matches = _engine().match_many(policy, [d.get('attributes', []) for d in drivers])
+        
+        return 200, {
+            'success': True,
+            'matches': [
+                {'id': d.get('id'), 'matches': m} for d, m in zip(drivers, matches)
+            ]
+        }
+        
+    except Exception as e:
+        return 500, {
+            'success': False,
+            'error': str(e)
+        }
+
+
+def _rekey_impl(data: Dict) -> Tuple[int, Dict]:
+    """Generate re-encryption key RK"""
+    engine = _engine()
     
-    if not system_params:
-        return jsonify({
+    if not engine.params:
+        return 400, {
             'success': False,
             'error': 'System not initialized'
-        }), 400
+        }
     
     try:
-        data = request.get_json()
         ct_data = data.get('original_ct')
         target_policy_data = data.get('target_policy')
         admin_ptid = data.get('admin_ptid')
         
         if not ct_data or not target_policy_data:
-            return jsonify({
+            return 400, {
                 'success': False,
                 'error': 'Missing required fields'
-            }), 400
-        
-        # Parse inputs
-        original_ct = Ciphertext.from_dict(ct_data)
-        target_policy = AccessPolicy.from_dict(target_policy_data)
+            }
         
-        # Generate temporary driver keys for re-encryption
-        # In a real system, these would be the actual driver's keys
-        driver_ptid = 'temp_driver_' + str(hash(str(target_policy.to_dict())))
-        driver_keys = crypto_engine.keygen(list(target_policy.rho.values()), driver_ptid)
+        error = _validate_policy(target_policy_data) or _validate_policy(ct_data.get('policy'))
+        if error:
+            return error
         
-        # Generate temporary rider keys
-        rider_ptid = 'temp_rider_' + str(hash(str(original_ct.ct_hash)))
-        rider_keys = crypto_engine.keygen(list(original_ct.policy.rho.values()), rider_ptid)
+        # Parse inputs
+        original_ct = _parse_ciphertext(ct_data)
+        target_policy = _parse_policy(target_policy_data)
         
-        # Generate re-encryption key from rider to driver
-        rk = crypto_engine.generate_rekey(rider_keys, driver_keys.sk, driver_ptid)
+        with _crypto_slot():
+            # Generate temporary driver keys for re-encryption
+            # In a real system, these would be the actual driver's keys
+            driver_ptid = _stable_id(target_policy.to_dict(), 'temp_driver_')
+            driver_keys = engine.keygen(list(target_policy.rho.values()), driver_ptid)
+            
+            # Generate temporary rider keys
+            rider_ptid = _stable_id(original_ct.ct_hash, 'temp_rider_')
+            rider_keys = engine.keygen(list(original_ct.policy.rho.values()), rider_ptid)
+            
+            # Generate re-encryption key from rider to driver
+            rk = engine.generate_rekey(rider_keys, orjson.dumps(driver_keys.sk).decode(), driver_ptid)
         
-        return jsonify({
+        return 200, {
             'success': True,
             'rekey': rk.to_dict()
-        }), 200
+        }
         
+    except CryptoBusyError as e:
+        return 503, {
+            'success': False,
+            'error': str(e)
+        }
     except Exception as e:
-        return jsonify({
+        return 500, {
             'success': False,
             'error': str(e)
-        }), 500
+        }
 
 
-@crypto_bp.route('/reencrypt', methods=['POST'])
-def reencrypt():
-    """
-    POST /reencrypt
-    Re-encrypt CT to CT' using RK
-    Body: {
-        ciphertext: Ciphertext,
-        rekey: ReencryptionKey
-    }
-    """
-    global system_params
+def _reencrypt_impl(data: Dict) -> Tuple[int, Dict]:
+    """Re-encrypt CT to CT' using RK"""
+    engine = _engine()
     
-    if not system_params:
-        return jsonify({
+    if not engine.params:
+        return 400, {
             'success': False,
             'error': 'System not initialized'
-        }), 400
+        }
     
     try:
-        data = request.get_json()
         ct_data = data.get('ciphertext')
         rk_data = data.get('rekey')
         
         if not ct_data or not rk_data:
-            return jsonify({
+            return 400, {
                 'success': False,
                 'error': 'Missing ciphertext or rekey'
-            }), 400
+            }
         
-        # Parse inputs
-        ct = Ciphertext.from_dict(ct_data)
+        error = _validate_policy(ct_data.get('policy'))
+        if error:
+            return error
         
-        from models import ReencryptionKey
-        rk = ReencryptionKey(
-            rk=rk_data['rk'],
-            ptid_from=rk_data.get('ptid_from', ''),
-            ptid_to=rk_data.get('ptid_to', '')
-        )
+        # Parse inputs
+        ct = _parse_ciphertext(ct_data)
+        rk = ReencryptionKey.from_dict(rk_data)
         
         # Re-encrypt (Windows implementation doesn't need system_params)
-        ct_prime = crypto_engine.reencrypt(ct, rk)
+        ct_prime = _offload('reencrypt', ct, rk)
         
-        return jsonify({
+        return 200, {
             'success': True,
             'ct_prime': ct_prime.to_dict(),
             'ct_prime_hash': ct_prime.ct_prime_hash
-        }), 200
+        }
         
+    except CryptoBusyError as e:
+        return 503, {
+            'success': False,
+            'error': str(e)
+        }
+    except CryptoTimeoutError as e:
+        return 504, {
+            'success': False,
+            'error': str(e)
+        }
     except Exception as e:
-        return jsonify({
+        return 500, {
             'success': False,
             'error': str(e)
-        }), 500
+        }
 
 
-@crypto_bp.route('/verify', methods=['POST'])
-def verify():
-    """
-    POST /verify
-    Verify CT' before decryption: R'' = g^{H1(F)}
-    Body: {
-        ct_prime: ReencryptedCiphertext,
-        user_ptid: string
-    }
-    """
-    global system_params, user_keys_store
+def _verify_impl(data: Dict) -> Tuple[int, Dict]:
+    """Verify CT' before decryption: R'' = g^{H1(F)}"""
+    engine = _engine()
     
-    if not system_params:
-        return jsonify({
+    if not engine.params:
+        return 400, {
             'success': False,
             'error': 'System not initialized'
-        }), 400
+        }
     
     try:
-        data = request.get_json()
         ct_prime_data = data.get('ct_prime')
         user_ptid = data.get('user_ptid')
         
         if not ct_prime_data or not user_ptid:
-            return jsonify({
+            return 400, {
                 'success': False,
                 'error': 'Missing ct_prime or user_ptid'
-            }), 400
+            }
         
         # Get user keys
-        user_sk = user_keys_store.get(user_ptid)
+        user_sk = _get_keys(user_ptid)
         if not user_sk:
-            return jsonify({
+            return 404, {
                 'success': False,
                 'error': 'User keys not found'
-            }), 404
+            }
         
         # Parse CT'
-        ct_prime = ReencryptedCiphertext(
-            ct_prime=ct_prime_data['ct_prime'],
-            ct_prime_hash=ct_prime_data['ct_prime_hash'],
-            r_double_prime=ct_prime_data['r_double_prime']
-        )
+        ct_prime = _parse_ct_prime(ct_prime_data)
         
         # Verify (Windows implementation doesn't need system_params or user_sk)
-        is_valid = crypto_engine.verify(ct_prime)
+        is_valid = engine.verify(ct_prime)
         
-        return jsonify({
+        return 200, {
             'success': True,
             'valid': is_valid
-        }), 200
+        }
         
     except Exception as e:
-        return jsonify({
+        return 500, {
             'success': False,
             'error': str(e)
-        }), 500
+        }
 
 
-@crypto_bp.route('/decrypt', methods=['POST'])
-def decrypt():
-    """
-    POST /decrypt
-    Decrypt CT' to recover plaintext
-    Body: {
-        ct_prime: ReencryptedCiphertext,
-        user_ptid: string
-    }
-    """
-    global system_params, user_keys_store
+def _decrypt_impl(data: Dict) -> Tuple[int, Dict]:
+    """Decrypt CT' to recover plaintext"""
+    engine = _engine()
     
-    if not system_params:
-        return jsonify({
+    if not engine.params:
+        return 400, {
             'success': False,
             'error': 'System not initialized'
-        }), 400
+        }
     
     try:
-        data = request.get_json()
         ct_prime_data = data.get('ct_prime')
         user_ptid = data.get('user_ptid')
         
         if not ct_prime_data or not user_ptid:
-            return jsonify({
+            return 400, {
                 'success': False,
                 'error': 'Missing ct_prime or user_ptid'
-            }), 400
+            }
         
         # Get user keys
-        user_sk = user_keys_store.get(user_ptid)
+        user_sk = _get_keys(user_ptid)
         if not user_sk:
-            return jsonify({
+            return 404, {
                 'success': False,
                 'error': 'User keys not found'
-            }), 404
+            }
         
         # Parse CT'
-        ct_prime = ReencryptedCiphertext(
-            ct_prime=ct_prime_data['ct_prime'],
-            ct_prime_hash=ct_prime_data['ct_prime_hash'],
-            r_double_prime=ct_prime_data['r_double_prime']
-        )
+        ct_prime = _parse_ct_prime(ct_prime_data)
         
         # Decrypt (Windows implementation doesn't need system_params)
-        plaintext = crypto_engine.decrypt(ct_prime, user_sk)
+        plaintext = _offload('decrypt', ct_prime, user_sk)
         
-        return jsonify({
+        return 200, {
             'success': True,
             'plaintext': plaintext
-        }), 200
+        }
         
+    except CryptoBusyError as e:
+        return 503, {
+            'success': False,
+            'error': str(e)
+        }
+    except CryptoTimeoutError as e:
+        return 504, {
+            'success': False,
+            'error': str(e)
+        }
     except Exception as e:
-        return jsonify({
+        return 500, {
             'success': False,
             'error': str(e)
-        }), 500
+        }
+
+
+@crypto_bp.route('/setup', methods=['POST'])
+def setup():
+    """
+    POST /setup
+    Initialize system parameters (PK_S, MK_S); already-initialized params
+    are returned unchanged (restart the service to rotate them)
+    """
+    status, payload = _setup_impl(_body() or {})
+    response = ojsonify(payload, status)
+    if status == 200:
+        response.set_etag(_params_etag(_engine().params))
+    return response
+
+
+@crypto_bp.route('/setup', methods=['GET'])
+def get_setup():
+    """
+    GET /setup
+    Current public parameters; honours If-None-Match with the ETag from POST /setup
+    """
+    params = _engine().params
+    if not params:
+        return ojsonify({
+            'success': False,
+            'error': 'System not initialized. Call POST /setup first'
+        }, 404)
+    
+    response = ojsonify({
+        'success': True,
+        'params': {
+            'pk': params.pk,
+            'initialized': True
+        }
+    }, 200)
+    response.set_etag(_params_etag(params))
+    response.cache_control.public = True
+    response.cache_control.max_age = SETUP_MAX_AGE
+    return response.make_conditional(request)
+
+
+@crypto_bp.route('/keygen', methods=['POST'])
+def keygen():
+    """
+    POST /keygen
+    Generate user keys (SK_U, PK_U) for given attributes
+    Body: { attributes: string[], user_id: string }
+    """
+    status, payload = _keygen_impl(_body() or {})
+    return ojsonify(payload, status)
+
+
+@crypto_bp.route('/encrypt', methods=['POST'])
+@limiter.limit(HEAVY_RATE_LIMIT)
+def encrypt():
+    """
+    POST /encrypt
+    Encrypt plaintext with access policy (M, ρ)
+    Body: { 
+        plaintext: string,
+        policy: { matrix: number[][], rho: {[key: number]: string} }
+    }
+    """
+    status, payload = _encrypt_impl(_body() or {})
+    return stream_ojsonify(payload, status)
+
+
+@crypto_bp.route('/match', methods=['POST'])
+def match():
+    """
+    POST /match
+    Check if driver attributes satisfy rider's policy
+    Body: {
+        driver_attributes: string[],
+        policy: { matrix: number[][], rho: {[key: number]: string} }
+    }
+    """
+    status, payload = _match_impl(_body() or {})
+    return ojsonify(payload, status)
+
+
+@crypto_bp.route('/match_many', methods=['POST'])
+def match_many():
+    """
+    POST /match_many
+    Check many drivers against one rider policy
+    Body: {
+        drivers: { id: string, attributes: string[] }[],
+        policy: { matrix: number[][], rho: {[key: number]: string} }
+    }
+    """
+    status, payload = _match_many_impl(_body() or {})
+    return ojsonify(payload, status)
+
+
+@crypto_bp.route('/rekey', methods=['POST'])
+@limiter.limit(HEAVY_RATE_LIMIT)
+def rekey():
+    """
+    POST /rekey
+    Generate re-encryption key RK
+    Body: {
+        original_ct: Ciphertext,
+        target_policy: AccessPolicy,
+        admin_ptid: string
+    }
+    """
+    status, payload = _rekey_impl(_body() or {})
+    return ojsonify(payload, status)
+
+
+@crypto_bp.route('/reencrypt', methods=['POST'])
+@limiter.limit(HEAVY_RATE_LIMIT)
+def reencrypt():
+    """
+    POST /reencrypt
+    Re-encrypt CT to CT' using RK
+    Body: {
+        ciphertext: Ciphertext,
+        rekey: ReencryptionKey
+    }
+    """
+    status, payload = _reencrypt_impl(_body() or {})
+    return stream_ojsonify(payload, status)
+
+
+@crypto_bp.route('/verify', methods=['POST'])
+def verify():
+    """
+    POST /verify
+    Verify CT' before decryption: R'' = g^{H1(F)}
+    Body: {
+        ct_prime: ReencryptedCiphertext,
+        user_ptid: string
+    }
+    """
+    status, payload = _verify_impl(_body() or {})
+    return ojsonify(payload, status)
+
+
+@crypto_bp.route('/decrypt', methods=['POST'])
+def decrypt():
+    """
+    POST /decrypt
+    Decrypt CT' to recover plaintext
+    Body: {
+        ct_prime: ReencryptedCiphertext,
+        user_ptid: string
+    }
+    """
+    status, payload = _decrypt_impl(_body() or {})
+    return ojsonify(payload, status)
+
+
+# Operations accepted by /batch (setup is excluded: it re-initializes the system)
+_BATCH_OPS = {
+    'keygen': _keygen_impl,
+    'encrypt': _encrypt_impl,
+    'match': _match_impl,
+    'match_many': _match_many_impl,
+    'rekey': _rekey_impl,
+    'reencrypt': _reencrypt_impl,
+    'verify': _verify_impl,
+    'decrypt': _decrypt_impl,
+}
+
+
+# Ops that count against HEAVY_RATE_LIMIT when run through /batch
+_HEAVY_OPS = {'encrypt', 'rekey', 'reencrypt'}
+
+
+def _batch_items() -> Any:
+    """/batch body, parsed once and shared by the rate limit and the view"""
+    if 'batch_items' not in g:
+        g.batch_items = _body()
+    return g.batch_items
+
+
+def _batch_cost() -> int:
+    """Each heavy item in a batch costs one hit of HEAVY_RATE_LIMIT"""
+    items = _batch_items()
+    if not isinstance(items, list):
+        return 1
+    return max(1, sum(isinstance(item, dict) and item.get('op') in _HEAVY_OPS for item in items))
+
+
+@crypto_bp.route('/batch', methods=['POST'])
+@limiter.limit(HEAVY_RATE_LIMIT, cost=_batch_cost)
+def batch():
+    """
+    POST /batch
+    Run several operations in one request; results keep the request order
+    Body: [ { id?: any, op: string, params: object } ]
+    """
+    items = _batch_items()
+    if not isinstance(items, list):
+        return ojsonify({
+            'success': False,
+            'error': 'Body must be an array of { op, params } items'
+        }, 400)
+    
+    max_batch = current_app.config.get('MAX_BATCH', 64)
+    if len(items) > max_batch:
+        return ojsonify({
+            'success': False,
+            'error': f'Batch too large (max {max_batch} items)'
+        }, 413)
+    
+    results = []
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        impl = _BATCH_OPS.get(item.get('op'))
+        if impl is None:
+            results.append({
+                'id': item.get('id'),
+                'success': False,
+                'status': 400,
+                'error': f"Unknown op: {item.get('op')}"
+            })
+            continue
+        
+        status, payload = impl(item.get('params') or {})
+        result = {'id': item.get('id'), 'success': payload.get('success', False), 'status': status}
+        if result['success']:
+            result['result'] = payload
+        else:
+            result['error'] = payload.get('error')
+        results.append(result)
+    
+    return ojsonify({
+        'success': True,
+        'results': results
+    }, 200)
+
+
+@crypto_bp.route('/cache/clear', methods=['POST'])
+def clear_cache():
+    """
+    POST /cache/clear
+    Drop all cached parsed ciphertexts and policies
+    """
+    global _parse_cache_bytes
+    with _parse_cache_lock:
+        cleared = len(_parse_cache)
+        _parse_cache.clear()
+        _parse_cache_bytes = 0
+    
+    return ojsonify({
+        'success': True,
+        'cleared': cleared
+    }, 200)
 
 
 @crypto_bp.route('/health', methods=['GET'])
+@limiter.exempt
 def health():
     """Health check endpoint"""
-    return jsonify({
-        'success': True,
-        'status': 'healthy',
-        'initialized': system_params is not None
-    }), 200
+    response = current_app.response_class(
+        _HEALTH_BODIES[_engine().params is not None],
+        mimetype='application/json'
+    )
+    response.cache_control.max_age = HEALTH_MAX_AGE
+    return response
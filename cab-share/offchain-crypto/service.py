@@ -3,47 +3,84 @@ Flask service for CP-ABE with Proxy Re-Encryption
 Main entry point for the crypto service
 """
 
-from flask import Flask
-from flask_cors import CORS
-from routes import crypto_bp
-import os
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables before routes reads its settings at import
 load_dotenv()
 
-# Create Flask app
-app = Flask(__name__)
-CORS(app)
-
-# Register blueprints
-app.register_blueprint(crypto_bp, url_prefix='/api/crypto')
-
-# Configuration
-app.config['JSON_SORT_KEYS'] = False
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max request size
-
-@app.route('/')
-def index():
-    return {
-        'service': 'CP-ABE Proxy Re-Encryption Service',
-        'version': '1.0.0',
-        'endpoints': {
-            'setup': 'POST /api/crypto/setup',
-            'keygen': 'POST /api/crypto/keygen',
-            'encrypt': 'POST /api/crypto/encrypt',
-            'match': 'POST /api/crypto/match',
-            'rekey': 'POST /api/crypto/rekey',
-            'reencrypt': 'POST /api/crypto/reencrypt',
-            'verify': 'POST /api/crypto/verify',
-            'decrypt': 'POST /api/crypto/decrypt',
-            'health': 'GET /api/crypto/health'
-        }
+from flask import Flask
+from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+from crypto_engine_windows import CPABEProxyReenc
+from routes import crypto_bp, limiter, rate_limited, HEALTH_MAX_AGE
+import orjson
+import os
+import sys
+
+# Static response bodies, encoded once at import
+_INDEX = orjson.dumps({
+    'service': 'CP-ABE Proxy Re-Encryption Service',
+    'version': '1.0.0',
+    'endpoints': {
+        'setup': 'POST /api/crypto/setup',
+        'params': 'GET /api/crypto/setup',
+        'keygen': 'POST /api/crypto/keygen',
+        'encrypt': 'POST /api/crypto/encrypt',
+        'match': 'POST /api/crypto/match',
+        'match_many': 'POST /api/crypto/match_many',
+        'rekey': 'POST /api/crypto/rekey',
+        'reencrypt': 'POST /api/crypto/reencrypt',
+        'verify': 'POST /api/crypto/verify',
+        'decrypt': 'POST /api/crypto/decrypt',
+        'batch': 'POST /api/crypto/batch',
+        'health': 'GET /api/crypto/health'
     }
+})
+_HEALTH = orjson.dumps({'status': 'healthy'})
+
+
+def create_app() -> Flask:
+    """
+    Application factory
+    The crypto engine is set up here, so with gunicorn --preload every worker
+    forks from one initialized engine and shares the same system parameters
+    """
+    app = Flask(__name__)
+    CORS(app)
+    # Behind nginx: take the client address from its X-Forwarded-For. Only
+    # when TRUST_PROXY is set; on a direct bind clients could forge the header
+    if os.getenv('TRUST_PROXY', '').lower() in ('1', 'true', 'yes'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+    
+    # Register blueprints
+    app.register_blueprint(crypto_bp, url_prefix='/api/crypto')
+    
+    # Configuration
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max request size
+    app.config['MAX_BATCH'] = 64  # Max operations per /api/crypto/batch request
+    
+    # Per-client rate limits (see routes.limiter)
+    limiter.init_app(app)
+    app.register_error_handler(429, rate_limited)
+    
+    # Crypto engine with system params (PK_S, MK_S), read by routes via current_app
+    engine = CPABEProxyReenc()
+    engine.setup()
+    app.extensions['crypto'] = engine
+    
+    @app.route('/')
+    def index():
+        return app.response_class(_INDEX, mimetype='application/json')
+    
+    @app.route('/health')
+    @limiter.exempt
+    def health():
+        response = app.response_class(_HEALTH, mimetype='application/json')
+        response.cache_control.max_age = HEALTH_MAX_AGE
+        return response
+    
+    return app
 
-@app.route('/health')
-def health():
-    return {'status': 'healthy'}, 200
 
 if __name__ == '__main__':
     port = int(os.getenv('CRYPTO_SERVICE_PORT', 5123))
@@ -57,4 +94,17 @@ if __name__ == '__main__':
     ╚══════════════════════════════════════════════════════════╝
     """)
     
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    if debug or os.name == 'nt':
+        # Flask dev server (gunicorn does not run on Windows)
+        app = create_app()
+        app.run(host='0.0.0.0', port=port, debug=debug)
+    else:
+        # Production: hand the process over to gunicorn (see gunicorn.conf.py)
+        here = os.path.dirname(os.path.abspath(__file__))
+        # Run gunicorn from this interpreter so a venv works without it on PATH
+        os.execv(sys.executable, [
+            sys.executable, '-m', 'gunicorn',
+            '--chdir', here,
+            '-c', os.path.join(here, 'gunicorn.conf.py'),
+            'service:create_app()'
+        ])